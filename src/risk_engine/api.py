@@ -1,27 +1,54 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import jwt
 from risk_engine.core import data_loader, simulator, risk_metrics
 import numpy as np
-import hashlib
-import json
+import hmac
+import time
+import xxhash
+import struct
 import fakeredis
+import redis
+import orjson
 import os
 
 # Security Config
 SECRET_KEY = os.getenv("RISK_ENGINE_SECRET", "super-secret-admin-key-change-in-production")
+SECRET_BYTES = SECRET_KEY.encode()  # Encoded once instead of on every sign/verify
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 ADMIN_PASS = os.getenv("ADMIN_PASS", "admin123")
 
+# Distribute simulations over a Ray cluster instead of local threads (worth it for multi-node setups)
+USE_RAY = os.getenv("RISK_ENGINE_USE_RAY", "0") == "1"
+# "cuda" draws the closed-form final prices on the GPU (needs CuPy)
+SIM_DEVICE = os.getenv("RISK_ENGINE_DEVICE", "cpu")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-app = FastAPI(title="Distributed Risk Engine API")
+# --- Cache ---
+def create_cache(url: str):
+    """Redis client for the given URL; 'fakeredis://' gives an in-memory fake for local dev and tests."""
+    if url.startswith("fakeredis://"):
+        return fakeredis.FakeStrictRedis()
+    return redis.Redis.from_url(url)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Created on startup rather than at import, so importing the module stays cheap and
+    # tests can swap app.state.cache for a mock. REDIS_URL is set by docker-compose.
+    app.state.cache = create_cache(os.getenv("REDIS_URL", "fakeredis://"))
+    yield
+    app.state.cache.close()
+
+app = FastAPI(title="Distributed Risk Engine API", lifespan=lifespan)
 
 # --- CORS Config ---
 app.add_middleware(
@@ -35,9 +62,15 @@ app.add_middleware(
 # --- Security Functions ---
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # JWT exp is a Unix timestamp; integer arithmetic avoids datetime/timedelta objects per login
+    expire = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(to_encode, SECRET_BYTES, algorithm=ALGORITHM)
+
+@lru_cache(maxsize=1024)
+def decode_token(token: str) -> dict:
+    """Verifies and decodes a JWT. Cached per token string, so the signature check runs once per token."""
+    return jwt.decode(token, SECRET_BYTES, algorithms=[ALGORITHM])
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
@@ -46,17 +79,23 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-    except JWTError:
+        # Decoding is cached, so expiry has to be checked again on every request
+        if payload.get("exp", 0) < time.time():
+            raise credentials_exception
+    except jwt.PyJWTError:
         raise credentials_exception
     return username
 
 @app.post("/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    if form_data.username == ADMIN_USER and form_data.password == ADMIN_PASS:
+    # Constant-time comparisons; evaluate both so timing doesn't reveal which one failed
+    user_ok = hmac.compare_digest(form_data.username.encode(), ADMIN_USER.encode())
+    pass_ok = hmac.compare_digest(form_data.password.encode(), ADMIN_PASS.encode())
+    if user_ok and pass_ok:
         access_token = create_access_token(data={"sub": form_data.username})
         return {"access_token": access_token, "token_type": "bearer"}
     raise HTTPException(
@@ -86,6 +125,10 @@ class SimulateRequest(BaseModel):
     drift: float = 0.05
 
 class RiskResponse(BaseModel):
+    """
+    Response schema of /simulate, used for the OpenAPI docs only.
+    The endpoint returns orjson bytes built from NumPy directly, so paths are never validated float by float.
+    """
     ticker: str
     var_95: float
     cvar_95: float
@@ -94,91 +137,148 @@ class RiskResponse(BaseModel):
     mean_price: float
     paths: Optional[List[List[float]]] = None
 
+# orjson serializes numeric and datetime NumPy arrays natively (OPT_SERIALIZE_NUMPY)
+NUMPY_JSON_KINDS = "biufM"
+
+def to_column_arrays(df) -> dict:
+    """
+    Column-oriented payload for orjson: {column: values}.
+    Numeric/datetime columns are passed as NumPy arrays; object columns (dates, tickers) fall back to lists.
+    """
+    columns = {}
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if values.dtype.kind in NUMPY_JSON_KINDS:
+            columns[col] = np.ascontiguousarray(values)
+        else:
+            columns[col] = values.tolist()
+    return columns
+
+def orjson_response(payload: dict) -> Response:
+    return Response(
+        content=orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC),
+        media_type="application/json"
+    )
+
 @app.post("/ingest")
 def ingest_data(req: IngestRequest, current_user: str = Depends(get_current_user)):
     try:
+        # Skip the download entirely when DuckDB already holds the requested range
+        stored_rows = data_loader.get_stored_row_count(req.tickers, req.start_date, req.end_date)
+        if stored_rows is not None:
+            return {"status": "cached", "rows": stored_rows, "message": "Data already stored, download skipped"}
+        
+        # No DuckDB connection is held during the download: a read-write connection would make
+        # DuckDB reject the read-only ones /data/{ticker} opens on the same file
         df = data_loader.fetch_market_data(req.tickers, req.start_date, req.end_date)
         if not df.empty:
             data_loader.save_to_duckdb(df)
-            # Create preview (first 10 rows, convert dates to string for JSON)
-            preview = df.head(10).copy()
-            if 'Date' in preview.columns:
-                preview['Date'] = preview['Date'].astype(str)
-            
-            return {
+            # Create preview (first 10 rows), column-oriented so no per-row dicts are built
+            preview = df.head(10)
+            return orjson_response({
                 "status": "success", 
                 "rows": len(df), 
-                "preview": preview.to_dict(orient='records')
-            }
+                "preview_columns": list(preview.columns),
+                "preview": to_column_arrays(preview)
+            })
         else:
-            return {"status": "warning", "message": "No data found", "preview": []}
+            return {"status": "warning", "message": "No data found", "preview": {}}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-import hashlib
-import json
-import fakeredis
+# Fixed-width binary layout of the numeric simulation parameters
+SIM_PARAMS_STRUCT = struct.Struct("<dqqdd")
 
-# Initialize fake redis (in-memory)
-cache = fakeredis.FakeStrictRedis()
+def pack_sim_params(ticker: str, initial_price: float, days: int, paths: int, volatility: float, drift: float) -> bytes:
+    """Packs simulation parameters as the ticker followed by a fixed-width block, so no two requests share a byte string."""
+    return ticker.encode() + SIM_PARAMS_STRUCT.pack(initial_price, days, paths, volatility, drift)
 
 def get_cache_key(req: SimulateRequest) -> str:
     """Generates a specialized hash key for the simulation request."""
-    # Create a string representation of the parameters
-    params = f"{req.ticker}-{req.initial_price}-{req.days}-{req.paths}-{req.volatility}-{req.drift}"
-    return hashlib.md5(params.encode()).hexdigest()
+    params = pack_sim_params(req.ticker, req.initial_price, req.days, req.paths, req.volatility, req.drift)
+    # Prefix with the model version so results from an older simulator are never served
+    return f"sim:{simulator.MODEL_VERSION}:{xxhash.xxh3_64_hexdigest(params)}"
+
+def get_sim_seed(ticker: str, initial_price: float, days: int, paths: int, volatility: float, drift: float) -> int:
+    """Derives the RNG seed from the parameters, so identical requests simulate identical paths."""
+    return xxhash.xxh3_64_intdigest(pack_sim_params(ticker, initial_price, days, paths, volatility, drift))
+
+def compute_risk(req: SimulateRequest):
+    """
+    Runs the simulation for a request.
+    Returns (metrics dict, first 50 full paths as a (50, days+1) array for the chart).
+    """
+    sim = simulator.MonteCarloSimulator(n_paths=req.paths, time_horizon=req.days, use_ray=USE_RAY, device=SIM_DEVICE)
+    # For metrics we only need the final prices; the first 50 full paths are kept for the chart
+    seed = get_sim_seed(req.ticker, req.initial_price, req.days, req.paths, req.volatility, req.drift)
+    final_prices, head_paths = sim.simulate_summary(S0=req.initial_price, mu=req.drift, sigma=req.volatility, n_keep=50, seed=seed)
+    
+    # Sort once and read both confidence levels from the same sorted array
+    sorted_prices = np.sort(final_prices)
+    var_95, cvar_95 = risk_metrics.var_cvar_from_sorted(sorted_prices, req.initial_price, 0.95)
+    var_99, cvar_99 = risk_metrics.var_cvar_from_sorted(sorted_prices, req.initial_price, 0.99)
+    
+    metrics = {
+        "ticker": req.ticker,
+        "var_95": var_95,
+        "cvar_95": cvar_95,
+        "var_99": var_99,
+        "cvar_99": cvar_99,
+        "mean_price": float(final_prices.mean(dtype=np.float64))
+    }
+    return metrics, np.ascontiguousarray(head_paths)
 
 @app.post("/simulate", response_model=RiskResponse)
-def run_simulation(req: SimulateRequest, current_user: str = Depends(get_current_user)):
+def run_simulation(req: SimulateRequest, request: Request, current_user: str = Depends(get_current_user)):
+    cache = request.app.state.cache
     try:
         # Check Cache
         cache_key = get_cache_key(req)
-        # cached_result = cache.get(cache_key) # Disable cache for dev
-        cached_result = None
+        try:
+            cached_result = cache.get(cache_key)
+        except redis.RedisError as e:
+            print(f"Cache Error: {e}")
+            cached_result = None
         
         if cached_result:
             print("Cache Hit!")
-            return RiskResponse(**json.loads(cached_result))
+            return Response(content=cached_result, media_type="application/json")
             
         # Run Simulation if miss
         print("Cache Miss - Running Simulation...")
-        sim = simulator.MonteCarloSimulator(n_paths=req.paths, time_horizon=req.days)
-        results = sim.simulate(S0=req.initial_price, mu=req.drift, sigma=req.volatility)
+        metrics, head_paths = compute_risk(req)
         
-        # Results is now (n_paths, days+1) matrix
-        # For metrics, we need the final prices (last column)
-        final_prices = results[:, -1]
-        
-        var_95 = risk_metrics.calculate_var(final_prices, req.initial_price, 0.95)
-        cvar_95 = risk_metrics.calculate_cvar(final_prices, req.initial_price, 0.95)
-        var_99 = risk_metrics.calculate_var(final_prices, req.initial_price, 0.99)
-        cvar_99 = risk_metrics.calculate_cvar(final_prices, req.initial_price, 0.99)
-        
-        # Prepare visualization data: take first 50 paths
-        vis_paths = []
-        try:
-             # Take top 50 paths (rows) and convert to list of lists
-             # results is numpy array [n_paths, days]
-             vis_paths = results[:50].tolist()
-        except Exception as e:
-            print(f"Vis Data Error: {e}")
-
-        response = RiskResponse(
-            ticker=req.ticker,
-            var_95=var_95,
-            cvar_95=cvar_95,
-            var_99=var_99,
-            cvar_99=cvar_99,
-            mean_price=float(final_prices.mean()),
-            paths=vis_paths
-        )
+        # Serialize straight from the NumPy paths: no tolist() and no Pydantic validation
+        # of every float. Matches the RiskResponse schema.
+        body = orjson.dumps({**metrics, "paths": head_paths}, option=orjson.OPT_SERIALIZE_NUMPY)
         
         # Save to Cache (1 hour expiry)
-        cache.setex(cache_key, 3600, response.json())
+        try:
+            cache.setex(cache_key, 3600, body)
+        except redis.RedisError as e:
+            print(f"Cache Error: {e}")
         
-        return response
+        return Response(content=body, media_type="application/json")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/simulate/stream")
+def stream_simulation(req: SimulateRequest, current_user: str = Depends(get_current_user)):
+    """
+    Same simulation as /simulate, streamed as NDJSON: a {"meta": metrics} line, then one line per chart path.
+    Clients can parse incrementally and the server never builds the full JSON document.
+    """
+    try:
+        metrics, head_paths = compute_risk(req)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    def generate():
+        yield orjson.dumps({"meta": metrics}) + b"\n"
+        for path in head_paths:
+            yield orjson.dumps(path, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 @app.get("/data/{ticker}")
 def get_market_data(ticker: str):
@@ -188,17 +288,16 @@ def get_market_data(ticker: str):
     try:
         df = data_loader.load_data_from_db(ticker)
         if df.empty:
-            return {"status": "warning", "message": f"No data found for {ticker}", "data": []}
+            return {"status": "warning", "message": f"No data found for {ticker}", "data": {}}
         
-        # Convert to list of dicts for JSON response
-        # df.to_dict(orient='records') handles Date objects gracefully usually, but let's be safe
-        records = df.to_dict(orient='records')
-        return {"status": "success", "data": records}
+        # Column-oriented JSON straight from the NumPy columns (no per-row dicts)
+        return orjson_response({"status": "success", "columns": list(df.columns), "data": to_column_arrays(df)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/stress-test")
-def run_stress_test(req: StressRequest, current_user: str = Depends(get_current_user)):
+def run_stress_test(req: StressRequest, request: Request, current_user: str = Depends(get_current_user)):
+    cache = request.app.state.cache
     try:
         if req.scenario_type == "price_shock":
             loss = risk_metrics.calculate_stress_impact(req.initial_price, req.shock_value)
@@ -214,15 +313,33 @@ def run_stress_test(req: StressRequest, current_user: str = Depends(get_current_
             # 1. Run Baseline Simulation (Normal Vol = 0.20 default or we should ask user? Let's assume 0.20 base)
             # Ideally we'd pass base_vol in request, but for now let's use 0.20 as "Normal"
             base_vol = 0.20
-            sim_base = simulator.MonteCarloSimulator(n_paths=5000, time_horizon=252)
-            res_base = sim_base.simulate(S0=req.initial_price, mu=0.05, sigma=base_vol)
-            var_base = risk_metrics.calculate_var(res_base[:, -1], req.initial_price, 0.99)
+            # The baseline depends only on (S0, mu, base_vol, days) and is seeded, so it is cached across requests
+            base_params = pack_sim_params("", req.initial_price, 252, 5000, base_vol, 0.05)
+            base_key = f"stress-base:{simulator.MODEL_VERSION}:{xxhash.xxh3_64_hexdigest(base_params)}"
+            try:
+                cached_base = cache.get(base_key)
+            except redis.RedisError as e:
+                print(f"Cache Error: {e}")
+                cached_base = None
             
-            # 2. Run Stressed Simulation
-            sim_stress = simulator.MonteCarloSimulator(n_paths=5000, time_horizon=252) 
-            res_stress = sim_stress.simulate(S0=req.initial_price, mu=0.05, sigma=req.shock_value)
-            final_prices = res_stress[:, -1]
+            if cached_base is not None:
+                var_base = float(cached_base)
+            else:
+                sim_base = simulator.MonteCarloSimulator(n_paths=5000, time_horizon=252, use_ray=USE_RAY, device=SIM_DEVICE)
+                base_seed = xxhash.xxh3_64_intdigest(base_params)
+                final_base, _ = sim_base.simulate_summary(S0=req.initial_price, mu=0.05, sigma=base_vol, n_keep=0, seed=base_seed)
+                var_base = risk_metrics.calculate_var(final_base, req.initial_price, 0.99)
+                # Save to Cache (1 day expiry)
+                try:
+                    cache.setex(base_key, 86400, repr(var_base))
+                except redis.RedisError as e:
+                    print(f"Cache Error: {e}")
             
+            # 2. Run Stressed Simulation (after the baseline: each run already spreads over every core,
+            # and the Numba kernel is serialised anyway, so running both at once gains nothing)
+            sim_stress = simulator.MonteCarloSimulator(n_paths=5000, time_horizon=252, use_ray=USE_RAY, device=SIM_DEVICE) 
+            stress_seed = get_sim_seed("", req.initial_price, 252, 5000, req.shock_value, 0.05)
+            final_prices, _ = sim_stress.simulate_summary(S0=req.initial_price, mu=0.05, sigma=req.shock_value, n_keep=0, seed=stress_seed)
             var_99 = risk_metrics.calculate_var(final_prices, req.initial_price, 0.99)
             
             return {
@@ -231,7 +348,7 @@ def run_stress_test(req: StressRequest, current_user: str = Depends(get_current_
                 "new_volatility": req.shock_value,
                 "normal_var_99": var_base,
                 "new_var_99": var_99,
-                "mean_price": float(final_prices.mean())
+                "mean_price": float(final_prices.mean(dtype=np.float64))
             }
         else:
             raise HTTPException(status_code=400, detail="Unknown scenario type. Use 'price_shock' or 'vol_shock'.")
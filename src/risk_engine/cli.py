@@ -1,5 +1,6 @@
 import click
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import os
 from pathlib import Path
@@ -7,6 +8,13 @@ from pathlib import Path
 API_URL = "http://127.0.0.1:8000"
 TOKEN_FILE = Path.home() / ".risk_engine_token"
 
+# One pooled session for all API calls, so repeated commands in a process (e.g. scripted
+# simulate runs) reuse the TCP connection instead of reconnecting every time
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
 def save_token(token):
     with open(TOKEN_FILE, "w") as f:
         f.write(token)
@@ -34,7 +42,7 @@ def cli():
 def login(username, password):
     """Log in to the API and save credentials."""
     try:
-        response = requests.post(f"{API_URL}/token", data={"username": username, "password": password})
+        response = _session.post(f"{API_URL}/token", data={"username": username, "password": password})
         if response.status_code == 200:
             token = response.json()["access_token"]
             save_token(token)
@@ -56,11 +64,13 @@ def ingest(ticker, start, end):
         "end_date": end
     }
     try:
-        response = requests.post(f"{API_URL}/ingest", json=payload, headers=get_auth_headers())
+        response = _session.post(f"{API_URL}/ingest", json=payload, headers=get_auth_headers())
         if response.status_code == 200:
             data = response.json()
             if data.get("status") == "success":
                 click.echo(f"Success: {data.get('rows')} rows loaded.")
+            elif data.get("status") == "cached":
+                click.echo(f"Already stored: {data.get('rows')} rows, download skipped.")
             else:
                 click.echo(f"Warning: {data.get('message')}")
         else:
@@ -87,7 +97,7 @@ def simulate(ticker, initial, days, paths, vol, drift):
     }
     try:
         click.echo(f"Requesting simulation for {ticker}...")
-        response = requests.post(f"{API_URL}/simulate", json=payload, headers=get_auth_headers())
+        response = _session.post(f"{API_URL}/simulate", json=payload, headers=get_auth_headers())
         res = response.json()
         
         if response.status_code == 200:
@@ -117,7 +127,7 @@ def stress_test(ticker, scenario_type, shock):
     }
     try:
         click.echo(f"Running {scenario_type} ({shock})...")
-        response = requests.post(f"{API_URL}/stress-test", json=payload, headers=get_auth_headers())
+        response = _session.post(f"{API_URL}/stress-test", json=payload, headers=get_auth_headers())
         res = response.json()
         
         if response.status_code == 200:
@@ -1,12 +1,84 @@
 import yfinance as yf
 import duckdb
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import ccxt
 from typing import List, Optional
 import os
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 DB_PATH = os.path.join(os.getcwd(), 'data', 'market_data.duckdb')
+# Raw downloads, one Parquet file per (source, ticker, date range), checked before any remote call
+CACHE_DIR = os.path.join(os.getcwd(), 'data', 'cache')
+
+PRICE_COLUMNS = ['Date', 'Ticker', 'Open', 'High', 'Low', 'Close', 'Volume']
+# Common Arrow schema for every source (Yahoo dates arrive as timestamps, Binance volumes as floats)
+PRICE_SCHEMA = pa.schema([
+    ('Date', pa.date32()),
+    ('Ticker', pa.string()),
+    ('Open', pa.float64()),
+    ('High', pa.float64()),
+    ('Low', pa.float64()),
+    ('Close', pa.float64()),
+    ('Volume', pa.float64()),
+])
+
+# How many calendar days the stored range may fall short at either end and still count as covering
+# a request: weekends/holidays mean the first/last trading day rarely equals the requested date
+COVERAGE_SLACK_DAYS = 4
+# Longest step between two stored days that still counts as covered. Exchanges do close for more than
+# a long weekend (Hurricane Sandy 2012-10-26 -> 10-31, Shanghai's Golden Week: 9 days), so holes up to
+# this size are taken for closures and not re-downloaded.
+COVERAGE_MAX_GAP_DAYS = 10
+
+# yfinance sends one chart request per ticker whatever the call shape, so tickers go to our own pool
+# one by one; the worker cap bounds how many requests hit Yahoo at once
+YAHOO_MAX_WORKERS = 8
+
+# Binance daily candles: pages of up to 1000 candles (one per day), capped at ~13 years for safety.
+# Once the first page shows where the data starts, the remaining page windows are known, so they
+# (and the tickers) are fetched concurrently.
+CRYPTO_PAGE_LIMIT = 1000
+CRYPTO_MAX_PAGES = 5
+CRYPTO_MAX_WORKERS = 4
+DAY_MS = 86400000
+# Request weight of a 1000-candle klines call, in units of exchange.rateLimit
+CRYPTO_REQUEST_COST = 5
+
+# One Binance client for the whole process: markets are loaded (an HTTP call) once instead of per ticker
+_binance = None
+_binance_lock = threading.Lock()
+# ccxt's own throttle reads and updates its last-request time without a lock, so concurrent threads
+# would pass it together. Requests are paced here instead: each one reserves the next free slot under
+# the lock, then waits for it outside, so the HTTP calls themselves still overlap.
+_binance_pace_lock = threading.Lock()
+_binance_next_slot = 0.0
+
+def get_binance() -> ccxt.binance:
+    """Returns the shared Binance client, creating it and loading its markets on first use."""
+    global _binance
+    with _binance_lock:
+        if _binance is None:
+            # Rate limiting is done by wait_binance_slot (thread-safe) rather than by ccxt
+            exchange = ccxt.binance({'enableRateLimit': False})
+            exchange.load_markets()
+            _binance = exchange
+    return _binance
+
+def wait_binance_slot(exchange: ccxt.binance, cost: int = CRYPTO_REQUEST_COST):
+    """Blocks until this thread may send its next request on the shared Binance client."""
+    global _binance_next_slot
+    with _binance_pace_lock:
+        now = time.monotonic()
+        slot = max(now, _binance_next_slot)
+        _binance_next_slot = slot + cost * exchange.rateLimit / 1000
+    if slot > now:
+        time.sleep(slot - now)
 
 def get_db_connection():
     """Establishes connection to DuckDB."""
@@ -19,67 +91,222 @@ def get_db_connection():
             High DOUBLE,
             Low DOUBLE,
             Close DOUBLE,
-            Volume BIGINT,
-            PRIMARY KEY (Date, Ticker)
+            Volume BIGINT
         )
     """)
+    # No PRIMARY KEY and no secondary index: either costs index maintenance on every inserted row.
+    # (Date, Ticker) stays unique because save_to_duckdb dedups each batch and replaces existing rows
+    # itself, and since rows go in sorted by (Ticker, Date), DuckDB's zone maps already prune the
+    # per-ticker range scans.
+    drop_primary_key(con)
     return con
 
+def drop_primary_key(con: duckdb.DuckDBPyConnection):
+    """
+    Rebuilds a market_prices table created with the old PRIMARY KEY (Date, Ticker) without it.
+    DuckDB cannot drop a primary key in place, so the rows are copied (sorted by Ticker, Date) into
+    a fresh table that replaces the old one. A no-op once the table has no primary key.
+    """
+    has_key = con.execute("""
+        SELECT COUNT(*) FROM duckdb_constraints()
+        WHERE table_name = 'market_prices' AND constraint_type = 'PRIMARY KEY'
+    """).fetchone()[0]
+    if not has_key:
+        return
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute("""
+            CREATE TABLE market_prices_unkeyed AS
+            SELECT Date, Ticker, Open, High, Low, Close, Volume FROM market_prices ORDER BY Ticker, Date
+        """)
+        con.execute("DROP TABLE market_prices")
+        con.execute("ALTER TABLE market_prices_unkeyed RENAME TO market_prices")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+def get_stored_row_count(tickers: List[str], start_date: str, end_date: str, con: Optional[duckdb.DuckDBPyConnection] = None) -> Optional[int]:
+    """
+    Returns the number of stored rows in [start_date, end_date] if DuckDB already covers
+    that range for every ticker (both ends and no gaps in between), otherwise None
+    (the data needs to be fetched).
+    Uses con if given (left open), otherwise opens and closes its own connection.
+    """
+    if not tickers or (con is None and not os.path.exists(DB_PATH)):
+        return None
+
+    start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    unique_tickers = list(dict.fromkeys(tickers))
+    placeholders = ", ".join("?" for _ in unique_tickers)
+
+    own_con = con is None
+    if own_con:
+        # Read-only, like the /data readers: DuckDB refuses a read-write and a read-only connection
+        # to the same file within one process
+        con = duckdb.connect(DB_PATH, read_only=True)
+    try:
+        # max_gap: the longest step in days between consecutive stored dates of a ticker
+        rows = con.execute(f"""
+            SELECT Ticker, COUNT(*), MIN(Date), MAX(Date), MAX(gap)
+            FROM (
+                SELECT Ticker, Date, Date - LAG(Date) OVER (PARTITION BY Ticker ORDER BY Date) AS gap
+                FROM market_prices
+                WHERE Ticker IN ({placeholders}) AND Date BETWEEN ? AND ?
+            )
+            GROUP BY Ticker
+        """, unique_tickers + [start, end]).fetchall()
+    except duckdb.CatalogException:
+        # The file exists but nothing was ever saved to it
+        return None
+    finally:
+        if own_con:
+            con.close()
+
+    if len(rows) < len(unique_tickers):
+        return None
+
+    slack = timedelta(days=COVERAGE_SLACK_DAYS)
+    for _, _, min_date, max_date, max_gap in rows:
+        if min_date > start + slack or max_date < end - slack:
+            return None
+        if max_gap is not None and max_gap > COVERAGE_MAX_GAP_DAYS:
+            return None
+
+    return sum(count for _, count, _, _, _ in rows)
+
+def price_cache_path(source: str, ticker: str, start_date: str, end_date: str) -> str:
+    """data/cache/{source}/{ticker}/{start}_{end}.parquet ('/' in crypto pairs becomes '-')."""
+    return os.path.join(CACHE_DIR, source, ticker.replace('/', '-'), f"{start_date}_{end_date}.parquet")
+
+def read_price_cache(source: str, ticker: str, start_date: str, end_date: str) -> Optional[pa.Table]:
+    """Returns the cached download for this ticker and range, or None if there is none."""
+    path = price_cache_path(source, ticker, start_date, end_date)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pq.read_table(path, columns=PRICE_COLUMNS).cast(PRICE_SCHEMA)
+    except Exception as e:
+        print(f"Ignoring unreadable cache file {path}: {e}")
+        return None
+
+def write_price_cache(table: pa.Table, source: str, ticker: str, start_date: str, end_date: str):
+    """
+    Stores a download in the Parquet cache. Ranges reaching today or later are not cached
+    (the last candles can still change), nor are downloads without a single valid Close.
+    """
+    if end_date >= datetime.now().strftime("%Y-%m-%d") or table.num_rows == table['Close'].null_count:
+        return
+    path = price_cache_path(source, ticker, start_date, end_date)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a concurrent reader never sees a half-written file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Could not cache {ticker}: {e}")
+
 def fetch_crypto_data(ticker: str, start_date: str, end_date: str) -> pd.DataFrame:
     """
     Fetches historical data from Binance via CCXT.
     Ticker format expected: 'BTC/USDT'
     """
+    cached = read_price_cache('binance', ticker, start_date, end_date)
+    if cached is not None:
+        return cached.to_pandas(date_as_object=True)
+
     print(f"Fetching crypto data for {ticker} from Binance...")
-    exchange = ccxt.binance()
+    try:
+        exchange = get_binance()
+    except Exception as e:
+        print(f"Error connecting to Binance: {e}")
+        return pd.DataFrame()
     
-    # Convert dates to timestamp (ms)
-    start_ts = int(datetime.strptime(start_date, "%Y-%m-%d").timestamp() * 1000)
-    end_ts = int(datetime.strptime(end_date, "%Y-%m-%d").timestamp() * 1000)
+    # Convert dates to timestamp (ms), as UTC midnight like Binance's daily candles
+    start_ts = exchange.parse8601(f"{start_date}T00:00:00Z")
+    end_ts = exchange.parse8601(f"{end_date}T00:00:00Z")
+    if start_ts is None or end_ts is None:
+        print(f"Invalid date range {start_date} - {end_date} for {ticker}")
+        return pd.DataFrame()
     
     # CCXT fetch_ohlcv fetches limited candles (usually 500 or 1000). 
-    # For a full range, we need a loop. For simplicity in this demo, we fetch the max allowed or loop once.
-    # Risk Engine usually needs daily data. '1d' timeframe.
-    
-    all_ohlcv = []
-    current_ts = start_ts
+    # For a full range we need several pages. Risk Engine usually needs daily data. '1d' timeframe,
+    # so each page covers a window of CRYPTO_PAGE_LIMIT days.
+    if start_ts >= end_ts:
+        return pd.DataFrame()
+    span = CRYPTO_PAGE_LIMIT * DAY_MS
+
+    def fetch_page(since: int) -> np.ndarray:
+        # Each page becomes one (n, 6) float64 block: [timestamp, open, high, low, close, volume]
+        wait_binance_slot(exchange)
+        return np.asarray(exchange.fetch_ohlcv(ticker, timeframe='1d', since=since, limit=CRYPTO_PAGE_LIMIT), dtype=np.float64).reshape(-1, 6)
+
+    def fetch_window(since: int) -> np.ndarray:
+        # Keep each page to its own window so it never overlaps the next one
+        ohlcv = fetch_page(since)
+        return ohlcv[ohlcv[:, 0] < since + span]
     
     try:
-        while current_ts < end_ts:
-            ohlcv = exchange.fetch_ohlcv(ticker, timeframe='1d', since=current_ts, limit=1000)
-            if not ohlcv:
-                break
-            all_ohlcv.extend(ohlcv)
-            current_ts = ohlcv[-1][0] + 86400000 # move to next day
-            
-            # small break to avoid rate limits if we were looping a lot.
-            if len(ohlcv) < 1000:
-                break
-                
-            if len(all_ohlcv) > 5000: # Cap at ~13 years for safety
-                break
+        # The first page goes alone: before the listing date Binance answers with candles from the listing
+        # on, so where the data really starts (and the page cap counts from) is only known once it arrives
+        first = fetch_page(start_ts)
+        pages = [first]
+        if len(first) > 0:
+            first_ts = int(first[0, 0])
+            pages[0] = first[first[:, 0] < first_ts + span]
+            page_starts = list(range(first_ts + span, end_ts, span))[:CRYPTO_MAX_PAGES - 1]
+            if page_starts:
+                with ThreadPoolExecutor(max_workers=min(len(page_starts), CRYPTO_MAX_WORKERS)) as pool:
+                    pages.extend(pool.map(fetch_window, page_starts))
+        ohlcv = np.vstack(pages)
                 
     except Exception as e:
         print(f"Error fetching {ticker} from Binance: {e}")
         return pd.DataFrame()
 
-    if not all_ohlcv:
+    if len(ohlcv) == 0:
         return pd.DataFrame()
 
-    # Convert to DataFrame
-    df = pd.DataFrame(all_ohlcv, columns=['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume'])
-    df['Date'] = pd.to_datetime(df['Timestamp'], unit='ms').dt.date
-    df['Ticker'] = ticker
-    
-    # Filter by date (fetch_ohlcv 'since' is inclusive, but we might have gone past end)
-    # We'll just return the relevant columns
-    final_df = df[['Date', 'Ticker', 'Open', 'High', 'Low', 'Close', 'Volume']]
-    return final_df
+    # Convert to DataFrame straight from the array columns (no per-cell Python objects)
+    # fetch_ohlcv 'since' is inclusive, but we might have gone past end; we keep the relevant columns
+    df = pd.DataFrame({
+        'Date': pd.to_datetime(ohlcv[:, 0].astype(np.int64), unit='ms').date,
+        'Ticker': ticker,
+        'Open': ohlcv[:, 1],
+        'High': ohlcv[:, 2],
+        'Low': ohlcv[:, 3],
+        'Close': ohlcv[:, 4],
+        'Volume': ohlcv[:, 5],
+    })
+    write_price_cache(pa.Table.from_pandas(df, schema=PRICE_SCHEMA, preserve_index=False), 'binance', ticker, start_date, end_date)
+    return df
+
+def fetch_yahoo_ticker(ticker: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """
+    Fetches one ticker from Yahoo. Returns an empty DataFrame if nothing was found.
+    """
+    try:
+        # threads=False: tickers already run on our own pool, and yfinance's thread cap is process-global
+        df = yf.download(ticker, start=start_date, end=end_date, group_by='ticker', auto_adjust=True, threads=False, progress=False)
+        # yfinance 0.2+ returns different structures. Data might not be MultiIndex if 1 ticker.
+        if isinstance(df.columns, pd.MultiIndex):
+             df.columns = df.columns.droplevel(0) # Drop ticker level if exists
+        if df.empty:
+            return pd.DataFrame()
+        df['Ticker'] = ticker
+        return df.reset_index()
+    except Exception as e:
+        print(f"Error fetching Yahoo data for {ticker}: {e}")
+        # If Yahoo fails physically (network), we just log it. Don't crash ingestion of others.
+        return pd.DataFrame()
 
 def fetch_market_data(tickers: List[str], start_date: str, end_date: str) -> pd.DataFrame:
     """
     Fetches historical market data. Routes to Binance for tickers with '/', otherwise Yahoo.
     """
+    # Per-ticker Arrow tables, concatenated once at the end without copying the column buffers
     all_data = []
     
     yahoo_tickers = []
@@ -91,91 +318,101 @@ def fetch_market_data(tickers: List[str], start_date: str, end_date: str) -> pd.
         else:
             yahoo_tickers.append(t)
             
-    # Process Yahoo Tickers
-    if yahoo_tickers:
-        print(f"Fetching Yahoo data for {yahoo_tickers}...")
-        try:
-            data = yf.download(yahoo_tickers, start=start_date, end=end_date, group_by='ticker', auto_adjust=True)
-            
-            if len(yahoo_tickers) == 1:
-                ticker = yahoo_tickers[0]
-                df = data.copy()
-                # yfinance 0.2+ returns different structures. Data might not be MultiIndex if 1 ticker.
-                if isinstance(df.columns, pd.MultiIndex):
-                     df.columns = df.columns.droplevel(0) # Drop ticker level if exists
-                
-                df['Ticker'] = ticker
-                df = df.reset_index()
-                all_data.append(df)
-            else:
-                # Multi-ticker
-                for ticker in yahoo_tickers:
-                    try:
-                        # Accessing MultiIndex columns: data[ticker] isn't always reliable with new pandas
-                        # Use cross-section if possible, or simple column access
-                        if ticker in data.columns.levels[0]:
-                             df = data.xs(ticker, level=0, axis=1).copy()
-                             df['Ticker'] = ticker
-                             df = df.reset_index()
-                             all_data.append(df)
-                    except Exception as ex:
-                        print(f"Skipping {ticker}: {ex}")
-        except Exception as e:
-            print(f"Error fetching Yahoo data: {e}")
-            # If Yahoo fails physically (network), we just log it. Don't crash ingestion of others.
-
-    # Process Crypto Tickers
-    for t in crypto_tickers:
-        df = fetch_crypto_data(t, start_date, end_date)
-        if not df.empty:
-            all_data.append(df)
+    # Process Yahoo Tickers (only the ones not in the disk cache are downloaded)
+    to_download = []
+    for t in yahoo_tickers:
+        cached = read_price_cache('yahoo', t, start_date, end_date)
+        if cached is not None:
+            all_data.append(cached)
+        else:
+            to_download.append(t)
+
+    if to_download:
+        print(f"Fetching Yahoo data for {to_download}...")
+        with ThreadPoolExecutor(max_workers=min(len(to_download), YAHOO_MAX_WORKERS)) as pool:
+            for ticker, df in zip(to_download, pool.map(lambda t: fetch_yahoo_ticker(t, start_date, end_date), to_download)):
+                if df.empty:
+                    continue
+                table = pa.Table.from_pandas(df[PRICE_COLUMNS], schema=PRICE_SCHEMA, preserve_index=False)
+                write_price_cache(table, 'yahoo', ticker, start_date, end_date)
+                all_data.append(table)
+
+    # Process Crypto Tickers (HTTP calls release the GIL, so threads overlap the round trips)
+    if crypto_tickers:
+        with ThreadPoolExecutor(max_workers=min(len(crypto_tickers), CRYPTO_MAX_WORKERS)) as pool:
+            for df in pool.map(lambda t: fetch_crypto_data(t, start_date, end_date), crypto_tickers):
+                if not df.empty:
+                    all_data.append(pa.Table.from_pandas(df, schema=PRICE_SCHEMA, preserve_index=False))
 
     if not all_data:
         return pd.DataFrame()
         
-    final_df = pd.concat(all_data)
-    
     # Ensure Date is date object
-    if pd.api.types.is_datetime64_any_dtype(final_df['Date']):
-        final_df['Date'] = final_df['Date'].dt.date
-        
-    return final_df
+    return pa.concat_tables(all_data).to_pandas(date_as_object=True)
 
-def save_to_duckdb(df: pd.DataFrame):
+def save_to_duckdb(df: pd.DataFrame, con: Optional[duckdb.DuckDBPyConnection] = None):
     """
-    Saves the DataFrame to DuckDB.
+    Saves the DataFrame to DuckDB, as one transaction.
+    Pass con (e.g. from `with get_db_connection() as con:`) to reuse one connection across several
+    saves; it is left open. Without it a connection is opened and closed for this call.
     """
     if df.empty:
         print("No data to save.")
         return
 
-    con = get_db_connection()
+    own_con = con is None
+    if own_con:
+        con = get_db_connection()
     
-    # We use 'INSERT OR IGNORE' or similar logic. DuckDB's insert from dataframe is clean.
-    # But we want to avoid duplicates.
-    # Simplest way: Create temp table, insert new records.
+    # Market data collides deterministically on (Date, Ticker): rather than an ON CONFLICT upsert,
+    # which gets slow as the table grows, delete the rows being replaced and insert the new ones,
+    # in one transaction. The batch goes through an unconstrained staging table first, where it is
+    # deduplicated and sorted by (Ticker, Date) in a single pass. When a key repeats within the batch,
+    # its last row wins (batch_row breaks the tie).
     
-    con.register('df_view', df)
+    # Registered as Arrow so DuckDB scans the columns directly instead of going through pandas objects
+    batch = pa.Table.from_pandas(df[PRICE_COLUMNS], preserve_index=False)
+    con.register('df_view', batch.append_column('batch_row', pa.array(np.arange(len(batch)))))
     
-    # Check what columns we have
-    # For simplicity, let's select specific columns
     try:
+        con.execute("BEGIN TRANSACTION")
+        if con.execute("SELECT NOT EXISTS (SELECT 1 FROM market_prices)").fetchone()[0]:
+            # Cold load: nothing to replace, so insert straight from the batch
+            con.execute("""
+                INSERT INTO market_prices 
+                SELECT DISTINCT ON (Ticker, Date) Date, Ticker, Open, High, Low, Close, Volume 
+                FROM df_view
+                ORDER BY Ticker, Date, batch_row DESC
+            """)
+            con.execute("COMMIT")
+            print(f"Saved/Updated {len(df)} rows in DuckDB.")
+            return
+
         con.execute("""
-            INSERT INTO market_prices 
-            SELECT Date, Ticker, Open, High, Low, Close, Volume 
+            CREATE OR REPLACE TEMP TABLE market_prices_stage AS
+            SELECT Date, Ticker, Open, High, Low, Close, Volume, batch_row 
             FROM df_view
-            ON CONFLICT (Date, Ticker) DO UPDATE SET
-                Open=EXCLUDED.Open,
-                High=EXCLUDED.High,
-                Low=EXCLUDED.Low,
-                Close=EXCLUDED.Close,
-                Volume=EXCLUDED.Volume
         """)
+        con.execute("""
+            DELETE FROM market_prices
+            WHERE (Date, Ticker) IN (SELECT Date, Ticker FROM market_prices_stage)
+        """)
+        con.execute("""
+            INSERT INTO market_prices 
+            SELECT DISTINCT ON (Ticker, Date) Date, Ticker, Open, High, Low, Close, Volume
+            FROM market_prices_stage
+            ORDER BY Ticker, Date, batch_row DESC
+        """)
+        con.execute("DROP TABLE market_prices_stage")
+        con.execute("COMMIT")
         print(f"Saved/Updated {len(df)} rows in DuckDB.")
     except Exception as e:
+        con.execute("ROLLBACK")
         print(f"Error saving to DB: {e}")
     finally:
-        con.close()
+        con.unregister('df_view')
+        if own_con:
+            con.close()
 
 def load_data_from_db(ticker: str) -> pd.DataFrame:
     """Loads data for a specific ticker from DuckDB."""
@@ -184,10 +421,26 @@ def load_data_from_db(ticker: str) -> pd.DataFrame:
     con.close()
     return df
 
+def load_closes_from_db(ticker: str) -> np.ndarray:
+    """
+    Loads only the Close series for a ticker (ordered by Date) as a float64 array, for callers that feed
+    prices to the simulator / risk metrics and need neither pandas nor the other columns.
+    Missing closes come back as NaN.
+    """
+    con = duckdb.connect(DB_PATH, read_only=True)
+    try:
+        closes = con.execute("SELECT Close FROM market_prices WHERE Ticker = ? ORDER BY Date", [ticker]).fetchnumpy()['Close']
+    finally:
+        con.close()
+    # fetchnumpy returns a masked array when the column has NULLs
+    return np.ma.filled(closes, np.nan).astype(np.float64, copy=False)
+
 if __name__ == "__main__":
     # Test
     tickers = ["AAPL", "MSFT"]
     df = fetch_market_data(tickers, "2023-01-01", "2023-12-31")
-    save_to_duckdb(df)
+    with get_db_connection() as con:
+        save_to_duckdb(df, con)
     print("Data loaded for AAPL:")
     print(load_data_from_db("AAPL").head())
+    print(f"Last AAPL close: {load_closes_from_db('AAPL')[-1]:.2f}")
@@ -1,51 +1,67 @@
 import numpy as np
+from typing import Tuple
+
+def _tail_index(n_scenarios: int, confidence_level: float) -> int:
+    """
+    Index of the VaR scenario among n_scenarios ordered outcomes: if confidence is 0.95, the 5th
+    percentile worst outcome. Scenarios 0..index form the CVaR tail.
+    """
+    return min(int((1 - confidence_level) * n_scenarios), n_scenarios - 1)
+
+def _var_cvar_at(prices: np.ndarray, k: int, initial_price: float) -> Tuple[float, float]:
+    """
+    (VaR, CVaR) from prices ordered around k: prices[k] is the VaR scenario and prices[:k + 1] the tail
+    at or below it (sorted, or just partitioned). Both are expressed as positive loss amounts, 0 if
+    we gained money at that percentile (unlikely for high conf).
+    """
+    # Quantiles commute with a constant shift, so the PnL array is never built: we work on prices
+    # and subtract the initial price from the scalars at the end.
+    var = initial_price - float(prices[k])
+    # Accumulate the tail in double precision even for float32 inputs
+    cvar = initial_price - float(prices[:k + 1].mean(dtype=np.float64))
+    
+    return max(var, 0.0), max(cvar, 0.0)
 
 def calculate_var(final_prices: np.ndarray, initial_price: float, confidence_level: float = 0.95) -> float:
     """
     Calculates Value at Risk (VaR).
     VaR is the maximum loss not exceeded with a given confidence level.
+    final_prices may be float32 (as produced by the simulator) or float64.
+    A CuPy array (device="cuda") also works: NumPy dispatches to CuPy, so it stays on the GPU.
     """
-    # Calculate PnL
-    pnl = final_prices - initial_price
-    
-    # Sort PnL
-    # We want the lower tail.
-    # If confidence is 0.95, we look at the 5th percentile worst outcome.
-    percentile = (1 - confidence_level) * 100
-    var = np.percentile(pnl, percentile)
-    
-    # VaR is typically expressed as a positive number (loss amount)
-    # But np.percentile returns the negative PnL.
-    # So if var is -100, it means we lose 100.
-    # Let's return the absolute loss if it's negative, or 0 if we gained money at that percentile (unlikely for high conf)
-    
-    return -var if var < 0 else 0.0
+    return calculate_var_cvar(final_prices, initial_price, confidence_level)[0]
 
 def calculate_cvar(final_prices: np.ndarray, initial_price: float, confidence_level: float = 0.95) -> float:
     """
     Calculates Conditional Value at Risk (CVaR) / Expected Shortfall.
     CVaR is the average loss of the scenarios that exceed VaR.
+    final_prices may be float32 (as produced by the simulator) or float64.
+    A CuPy array (device="cuda") also works: NumPy dispatches to CuPy, so it stays on the GPU.
     """
-    pnl = final_prices - initial_price
-    percentile = (1 - confidence_level) * 100
-    var_threshold = np.percentile(pnl, percentile)
-    
-    # Filter scenarios worse than VaR
-    tail_losses = pnl[pnl <= var_threshold]
-    
-    if len(tail_losses) == 0:
-        return 0.0
-        
-    cvar = tail_losses.mean()
-    
-    return -cvar if cvar < 0 else 0.0
+    return calculate_var_cvar(final_prices, initial_price, confidence_level)[1]
+
+def calculate_var_cvar(final_prices: np.ndarray, initial_price: float, confidence_level: float = 0.95) -> Tuple[float, float]:
+    """
+    Calculates (VaR, CVaR) together: one partition serves both metrics.
+    Only the VaR order statistic is needed, so partition (introselect, O(n)) instead of sorting;
+    afterwards the first k + 1 prices are exactly the tail (in no particular order), so no boolean
+    mask / filtered copy is needed for CVaR.
+    """
+    k = _tail_index(len(final_prices), confidence_level)
+    return _var_cvar_at(np.partition(final_prices, k), k, initial_price)
+
+def var_cvar_from_sorted(sorted_prices: np.ndarray, initial_price: float, confidence_level: float = 0.95) -> Tuple[float, float]:
+    """
+    Calculates (VaR, CVaR) from final prices already sorted in ascending order.
+    Sort once with np.sort and call this per confidence level: each lookup is an index, not a new sort.
+    """
+    return _var_cvar_at(sorted_prices, _tail_index(len(sorted_prices), confidence_level), initial_price)
 
 if __name__ == "__main__":
     # Test
     initial = 100
-    outcomes = np.random.normal(105, 10, 10000) # Mean 105 (gain), std 10
-    var_95 = calculate_var(outcomes, initial, 0.95)
-    cvar_95 = calculate_cvar(outcomes, initial, 0.95)
+    outcomes = np.random.default_rng().normal(105, 10, 10000) # Mean 105 (gain), std 10
+    var_95, cvar_95 = calculate_var_cvar(outcomes, initial, 0.95)
     print(f"CVaR 95%: {cvar_95:.2f}")
 
 def calculate_stress_impact(initial_price: float, shock_pct: float) -> float:
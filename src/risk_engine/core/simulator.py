@@ -1,77 +1,334 @@
 import numpy as np
 import ray
 import pandas as pd
-from typing import List
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
-# Initialize Ray if not already initialized
-if not ray.is_initialized():
-    ray.init(ignore_reinit_error=True)
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:  # Numba is optional; the NumPy/Ray path is used instead
+    HAS_NUMBA = False
 
-@ray.remote
-def simulate_chunk(S0: float, mu: float, sigma: float, T: int, dt: float, n_paths: int) -> np.ndarray:
+try:
+    import numexpr as ne
+    HAS_NUMEXPR = True
+except ImportError:  # numexpr is optional; plain in-place NumPy ops are used instead
+    HAS_NUMEXPR = False
+
+try:
+    from scipy.stats import qmc
+    from scipy.special import ndtri
+    HAS_SCIPY = True
+except ImportError:  # SciPy is optional; only needed for sampling="sobol"
+    HAS_SCIPY = False
+
+try:
+    import cupy as cp
+    HAS_CUPY = True
+except ImportError:  # CuPy is optional; only needed for device="cuda"
+    HAS_CUPY = False
+
+# Bump whenever the simulation output changes so cached results from older models are not reused
+MODEL_VERSION = "gbm-10"
+
+# Paths are stored in single precision: the Monte Carlo sampling error dwarfs float32 roundoff,
+# and it halves memory traffic for the (days+1, n_paths) matrix.
+PRICE_DTYPE = np.float32
+
+# Ray chunking. The split depends only on n_paths (never on the core count), so a seeded
+# run produces the same paths on any machine.
+MIN_PATHS_PER_CHUNK = 1000
+MAX_CHUNKS = 64
+# Final-price chunks are sized for the cache instead: 32k float32 prices is 128 KB, so a chunk of
+# 32k-64k paths stays in a 256 KB L2 through the exp pass. The count is not capped; large runs simply
+# produce more tasks, which also balances load better.
+FINAL_CHUNK_PATHS = 32 * 1024
+
+# How the closed-form final prices draw their normals:
+#   pseudo     - plain pseudo-random draws
+#   antithetic - every Z is paired with -Z (same distribution, lower variance of the estimates)
+#   sobol      - scrambled Sobol points through the inverse normal CDF (randomised quasi-Monte Carlo)
+SAMPLING_METHODS = ("pseudo", "antithetic", "sobol")
+
+# Paths per RNG block in the Numba kernel. Each block is seeded on its own so the
+# result does not depend on how prange schedules blocks across threads.
+NUMBA_BLOCK_SIZE = 1024
+
+# Local (single-node) backend: NumPy chunks run on this pool, since NumPy releases the GIL.
+_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+# Numba's default workqueue threading layer aborts on concurrent parallel calls; each call already
+# uses every core, so calls are serialised instead.
+_numba_lock = threading.Lock()
+
+def _ensure_ray():
+    # Initialize Ray if not already initialized (only when the Ray backend is used)
+    if not ray.is_initialized():
+        ray.init(ignore_reinit_error=True)
+
+def chunk_rng(seed: int, chunk_index: int) -> np.random.Generator:
+    """
+    Independent generator for chunk k of a seeded run: the k-th child of SeedSequence(seed),
+    identical to SeedSequence(seed).spawn(k + 1)[k] and the same no matter which worker runs the chunk.
+    SFC64 is the fastest bit generator NumPy ships.
+    """
+    return np.random.Generator(np.random.SFC64(np.random.SeedSequence(seed, spawn_key=(chunk_index,))))
+
+def chunk_seed32(seed: int, chunk_index: int) -> int:
+    """Same child seed as chunk_rng, reduced to the 31-bit range Numba's np.random.seed accepts."""
+    return int(np.random.SeedSequence(seed, spawn_key=(chunk_index,)).generate_state(1)[0] & 0x7FFFFFFF)
+
+if HAS_NUMBA:
+    @njit(parallel=True, fastmath=True, nogil=True, cache=True)
+    def _gbm_final(S0, mu, sigma, T, n_paths, seed):
+        """
+        Fused closed-form GBM kernel: RNG, drift and exp in one pass, final prices only.
+        """
+        # Single-precision arithmetic like the NumPy paths, so the exp runs as float32 SIMD lanes
+        drift = np.float32((mu - 0.5 * sigma * sigma) * T)
+        diffusion = np.float32(sigma * np.sqrt(T))
+        s0 = np.float32(S0)
+        out = np.empty(n_paths, dtype=np.float32)
+
+        n_blocks = (n_paths + NUMBA_BLOCK_SIZE - 1) // NUMBA_BLOCK_SIZE
+        for b in prange(n_blocks):
+            np.random.seed(seed + b)
+            start = b * NUMBA_BLOCK_SIZE
+            stop = min(start + NUMBA_BLOCK_SIZE, n_paths)
+            for i in range(start, stop):
+                out[i] = s0 * np.exp(drift + diffusion * np.float32(np.random.standard_normal()))
+        return out
+
+    # Compile (or load from the on-disk cache) at import so the first request doesn't pay the JIT cost
+    _gbm_final(100.0, 0.05, 0.2, 1.0, 1, 0)
+
+def draw_normals(rng: np.random.Generator, n_paths: int, sampling: str = "pseudo") -> np.ndarray:
+    """n_paths standard normals (PRICE_DTYPE, contiguous) drawn with one of SAMPLING_METHODS."""
+    if sampling == "antithetic":
+        half = rng.standard_normal((n_paths + 1) // 2, dtype=PRICE_DTYPE)
+        return np.concatenate([half, -half])[:n_paths]
+    if sampling == "sobol":
+        # A Sobol set is only balanced (one point per 1/n_paths stratum) when n_paths is a power of two
+        m = n_paths.bit_length() - 1
+        if n_paths < 1 or n_paths != 1 << m:
+            raise ValueError(f"sampling='sobol' needs a power-of-two n_paths, got {n_paths}")
+        u = qmc.Sobol(d=1, scramble=True, seed=rng).random_base2(m)[:, 0]
+        return ndtri(np.clip(u, 1e-12, 1 - 1e-12)).astype(PRICE_DTYPE)
+    return rng.standard_normal(n_paths, dtype=PRICE_DTYPE)
+
+def simulate_chunk(params: Tuple[float, float, float, float, float, int], n_paths: int, chunk_index: int) -> np.ndarray:
     """
     Simulates a chunk of paths using Geometric Brownian Motion.
-    Returns the full Price Paths for this chunk (shape: n_paths x days).
+    params = (S0, mu, sigma, T, dt, seed) is shared by every chunk of a run; only n_paths and chunk_index differ.
+    Returns the full Price Paths for this chunk (shape: days+1 x n_paths), starting at S0.
+    Paths are stored as columns so each time step, in particular the final one, is a contiguous row.
     """
+    S0, mu, sigma, T, dt, seed = params
     # Number of steps
-    N = int(T / dt)
-    
-    # Generate random shocks
-    # Shape: (n_paths, N)
-    shocks = np.random.normal(0, np.sqrt(dt), size=(n_paths, N))
-    
-    # Calculate paths
-    # We only need the final price for VaR usually, but let's return the whole path if needed?
-    # For distributed scale, returning whole paths is heavy. Let's return final prices for now.
-    # If we need the path for plotting, we can return a subset.
-    
-    # Vectorized calculation of final price:
-    # S_T = S_0 * exp( (mu - 0.5*sigma^2)*T + sigma * sum(dW) )
-    
-    drift = (mu - 0.5 * sigma**2) * dt
-    # Cumulative sum over time (axis 1 = days)
-    diffusion = sigma * np.cumsum(shocks, axis=1)
-    
-    # We need a time array for drift: [dt, 2dt, ... N*dt]
-    t = np.arange(1, N + 1) * dt
-    drift_cum = (mu - 0.5 * sigma**2) * t
-    
-    # ST is now (n_paths, N) matrix
-    ST = S0 * np.exp(drift_cum + diffusion)
-    
-    # Prepend S0 (optional, but good for charts). Let's stick to returning N steps first.
-    # Actually, Chart.js looks better if we start at S0. 
-    # Let's prepend S0 column.
-    S0_col = np.full((n_paths, 1), S0)
-    return np.hstack([S0_col, ST])
+    N = int(round(T / dt))
+    rng = chunk_rng(seed, chunk_index)
+
+    # Per-step log return: (mu - 0.5*sigma^2)*dt + sigma*sqrt(dt)*Z
+    # Both coefficients are scalars, so the whole update stays in NumPy's C loops.
+    drift = PRICE_DTYPE((mu - 0.5 * sigma**2) * dt)
+    diffusion = PRICE_DTYPE(sigma * np.sqrt(dt))
+
+    log_returns = rng.standard_normal((N, n_paths), dtype=PRICE_DTYPE)
+    if HAS_NUMEXPR:
+        # One fused, multi-threaded pass over the matrix instead of two
+        ne.evaluate("drift + diffusion * log_returns", out=log_returns)
+    else:
+        log_returns *= diffusion
+        log_returns += drift
+
+    # Allocate the output once with the S0 row in place (Chart.js looks better if we start at S0)
+    # and accumulate log prices straight into it, so no vstack / extra copies are needed.
+    paths = np.empty((N + 1, n_paths), dtype=PRICE_DTYPE)
+    paths[0] = 0.0
+    np.cumsum(log_returns, axis=0, out=paths[1:])
+    S0 = PRICE_DTYPE(S0)
+    # float32 exp is already SIMD-vectorised here: NumPy dispatches to AVX2/AVX-512 kernels at runtime
+    # and numexpr uses VML when available, so a hand-written intrinsics kernel would not gain much.
+    if HAS_NUMEXPR:
+        ne.evaluate("S0 * exp(paths)", out=paths)
+    else:
+        np.exp(paths, out=paths)
+        paths *= S0
+    return paths
+
+def simulate_final_chunk(params: Tuple[float, float, float, float, int, str], n_paths: int, chunk_index: int) -> np.ndarray:
+    """
+    Simulates only the final prices of a chunk of GBM paths (shape: n_paths), in closed form.
+    params = (S0, mu, sigma, T, seed, sampling) is shared by every chunk of a run.
+    The sum of the N iid N(0, dt) daily shocks is N(0, T), so one draw per path replaces the whole path.
+    """
+    S0, mu, sigma, T, seed, sampling = params
+    if HAS_NUMBA and sampling == "pseudo":
+        return _gbm_final(S0, mu, sigma, T, n_paths, chunk_seed32(seed, chunk_index))
+
+    rng = chunk_rng(seed, chunk_index)
+
+    # S_T = S_0 * exp( (mu - 0.5*sigma^2)*T + sigma*sqrt(T)*Z )
+    drift = PRICE_DTYPE((mu - 0.5 * sigma**2) * T)
+    diffusion = PRICE_DTYPE(sigma * np.sqrt(T))
+
+    final_prices = draw_normals(rng, n_paths, sampling)
+    final_prices *= diffusion
+    final_prices += drift
+    np.exp(final_prices, out=final_prices)
+    final_prices *= PRICE_DTYPE(S0)
+    return final_prices
+
+def _gbm_final_cuda(S0: float, mu: float, sigma: float, T: float, n_paths: int, seed: int, sampling: str = "pseudo"):
+    """
+    Closed-form final prices on the GPU. The result stays on the device as a CuPy array;
+    np.partition (used by the risk metrics) dispatches to CuPy for it, so only the final scalars are copied back.
+    Supports "pseudo" and "antithetic" sampling.
+    """
+    rng = cp.random.default_rng(seed)
+    drift = PRICE_DTYPE((mu - 0.5 * sigma**2) * T)
+    diffusion = PRICE_DTYPE(sigma * np.sqrt(T))
+
+    if sampling == "antithetic":
+        half = rng.standard_normal((n_paths + 1) // 2, dtype=PRICE_DTYPE)
+        final_prices = cp.concatenate([half, -half])[:n_paths]
+    else:
+        final_prices = rng.standard_normal(n_paths, dtype=PRICE_DTYPE)
+    final_prices *= diffusion
+    final_prices += drift
+    cp.exp(final_prices, out=final_prices)
+    final_prices *= PRICE_DTYPE(S0)
+    return final_prices
+
+simulate_chunk_remote = ray.remote(simulate_chunk)
+simulate_final_chunk_remote = ray.remote(simulate_final_chunk)
 
 class MonteCarloSimulator:
-    def __init__(self, n_paths: int = 10000, time_horizon: int = 252):
+    def __init__(self, n_paths: int = 10000, time_horizon: int = 252, use_ray: bool = False, device: str = "cpu",
+                 sampling: str = "pseudo"):
+        if device not in ("cpu", "cuda"):
+            raise ValueError(f"Unknown device {device!r}, expected 'cpu' or 'cuda'")
+        if device == "cuda" and not HAS_CUPY:
+            raise RuntimeError("device='cuda' requires CuPy (pip install cupy-cuda12x)")
+        if sampling not in SAMPLING_METHODS:
+            raise ValueError(f"Unknown sampling {sampling!r}, expected one of {SAMPLING_METHODS}")
+        if sampling == "sobol" and (device == "cuda" or not HAS_SCIPY):
+            raise RuntimeError("sampling='sobol' requires SciPy and device='cpu'")
         self.n_paths = n_paths
         self.time_horizon = time_horizon # Days
         self.dt = 1/252 # Daily steps
+        # Ray's task submission and pickling only pay off across several nodes;
+        # on one machine threads / Numba's prange are cheaper
+        self.use_ray = use_ray
+        # Closed-form final prices can run on the GPU; the step-by-step chart paths always stay on the CPU
+        self.device = device
+        # Variance reduction for the closed-form final prices (chart paths stay pseudo-random)
+        self.sampling = sampling
+
+    @staticmethod
+    def _chunk_sizes(n_paths: int, min_paths: int = MIN_PATHS_PER_CHUNK, max_chunks: Optional[int] = MAX_CHUNKS) -> List[int]:
+        """
+        Splits n_paths into Ray chunks (Ray spreads them over the available cores) of at least
+        min_paths paths each, and at most max_chunks chunks (None: no limit).
+        """
+        n_chunks = max(1, n_paths // min_paths)
+        if max_chunks is not None:
+            n_chunks = min(max_chunks, n_chunks)
+        paths_per_chunk = n_paths // n_chunks
+        remainder = n_paths % n_chunks
+        return [paths_per_chunk + (1 if i < remainder else 0) for i in range(n_chunks)]
+
+    @staticmethod
+    def _sobol_chunk_sizes(n_paths: int) -> List[int]:
+        """
+        Splits n_paths into power-of-two chunks, each a balanced Sobol set: full FINAL_CHUNK_PATHS
+        chunks, then the binary digits of the remainder, largest first.
+        """
+        full, remainder = divmod(n_paths, FINAL_CHUNK_PATHS)
+        return [FINAL_CHUNK_PATHS] * full + [1 << k for k in reversed(range(remainder.bit_length())) if remainder >> k & 1]
+
+    def _run_chunks(self, fn, remote_fn, params: tuple, chunks: List[tuple]) -> List[np.ndarray]:
+        """
+        Runs fn(params, *args) for every chunk's args: as Ray tasks when use_ray, otherwise on the local thread pool.
+        On Ray, params goes to the object store once and every task gets the same ObjectRef,
+        instead of pickling the shared values into each task.
+        """
+        if self.use_ray:
+            _ensure_ray()
+            params_ref = ray.put(params)
+            return ray.get([remote_fn.remote(params_ref, *args) for args in chunks])
+        if len(chunks) == 1:
+            return [fn(params, *chunks[0])]
+        return list(_executor.map(lambda args: fn(params, *args), chunks))
+
+    def simulate(self, S0: float, mu: float, sigma: float, seed: Optional[int] = None) -> np.ndarray:
+        """
+        Runs the simulation in parallel (local threads, or Ray when use_ray).
+        Returns a (days+1, n_paths) matrix: results[-1] is the contiguous array of final prices.
+        Passing a seed makes the run reproducible; otherwise a fresh one is drawn from OS entropy.
+        """
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+
+        params = (S0, mu, sigma, self.time_horizon/252, self.dt, seed)
+        chunks = [(count, i) for i, count in enumerate(self._chunk_sizes(self.n_paths)) if count > 0]
+        results = self._run_chunks(simulate_chunk, simulate_chunk_remote, params, chunks)
+        return np.concatenate(results, axis=1)
+
+    def _final_prices(self, S0: float, mu: float, sigma: float, n_paths: int, seed: int):
+        """
+        Closed-form final prices for n_paths paths, using child streams from MAX_CHUNKS on so
+        they never repeat the ones used for full paths. A CuPy array on device="cuda".
+        """
+        T = self.time_horizon / 252
+        if self.device == "cuda":
+            return _gbm_final_cuda(S0, mu, sigma, T, n_paths, chunk_seed32(seed, MAX_CHUNKS), self.sampling)
+        if HAS_NUMBA and not self.use_ray and self.sampling == "pseudo":
+            # A single kernel call: prange already spreads it over every core
+            with _numba_lock:
+                return _gbm_final(S0, mu, sigma, T, n_paths, chunk_seed32(seed, MAX_CHUNKS))
+        sizes = self._sobol_chunk_sizes(n_paths) if self.sampling == "sobol" else self._chunk_sizes(n_paths, FINAL_CHUNK_PATHS, None)
+        chunks = [(count, MAX_CHUNKS + i) for i, count in enumerate(sizes) if count > 0]
+        results = self._run_chunks(simulate_final_chunk, simulate_final_chunk_remote, (S0, mu, sigma, T, seed, self.sampling), chunks)
+        return np.concatenate(results) if results else np.empty(0, dtype=PRICE_DTYPE)
+
+    def simulate_final(self, S0: float, mu: float, sigma: float, seed: Optional[int] = None):
+        """
+        Final prices only (no chart paths), for large n_paths runs.
+        On device="cuda" the array stays on the GPU; calculate_var/calculate_cvar accept it as is.
+        """
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        return self._final_prices(S0, mu, sigma, self.n_paths, seed)
+
+    def simulate_summary(self, S0: float, mu: float, sigma: float, n_keep: int = 50, seed: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Runs the simulation but only returns what the risk metrics and charts need:
+        (final_prices, first n_keep full paths).
+        Both arrays are C-contiguous, so final_prices can go to every metric without further copies.
+        Only the n_keep chart paths are simulated step by step; every other path draws its final
+        price in closed form, so memory is O(n_paths) rather than O(n_paths * days).
+        """
+        n_keep = min(n_keep, self.n_paths)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+
+        # Full paths for the chart only
+        head = MonteCarloSimulator(n_paths=n_keep, time_horizon=self.time_horizon, use_ray=self.use_ray).simulate(S0, mu, sigma, seed=seed) \
+            if n_keep > 0 else np.empty((self.time_horizon + 1, 0), dtype=PRICE_DTYPE)
+
+        # Final prices for the remaining paths
+        rest = self._final_prices(S0, mu, sigma, self.n_paths - n_keep, seed)
+        if self.device == "cuda":
+            rest = cp.asnumpy(rest)
 
-    def simulate(self, S0: float, mu: float, sigma: float) -> np.ndarray:
-        """
-        Runs the simulation in parallel using Ray.
-        """
-        # Determine number of cores/chunks
-        n_cores = int(ray.available_resources().get("CPU", 1))
-        paths_per_chunk = self.n_paths // n_cores
-        remainder = self.n_paths % n_cores
-        
-        futures = []
-        for i in range(n_cores):
-            count = paths_per_chunk + (1 if i < remainder else 0)
-            if count > 0:
-                future = simulate_chunk.remote(S0, mu, sigma, self.time_horizon/252, self.dt, count)
-                futures.append(future)
-        
-        results = ray.get(futures)
-        return np.concatenate(results)
+        final_prices = np.concatenate([head[-1], rest])
+        return final_prices, np.ascontiguousarray(head.T)
 
 if __name__ == "__main__":
     sim = MonteCarloSimulator(n_paths=100000)
     results = sim.simulate(S0=100, mu=0.05, sigma=0.2)
-    print(f"Simulated {len(results)} paths.")
-    print(f"Mean final price: {results.mean():.2f}")
+    print(f"Simulated {results.shape[1]} paths.")
+    print(f"Mean final price: {results[-1].mean():.2f}")
@@ -0,0 +1,20 @@
+import pandas as pd
+import pytest
+
+from risk_engine.core import data_loader
+
+
+@pytest.fixture
+def prices():
+    """Builds a market_prices batch for one ticker: one row of constant prices per day."""
+    def build(ticker, days):
+        return pd.DataFrame({
+            'Date': days, 'Ticker': ticker,
+            'Open': 1.0, 'High': 1.0, 'Low': 1.0, 'Close': 1.0, 'Volume': 1,
+        })
+    return build
+
+
+@pytest.fixture
+def temp_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(data_loader, "DB_PATH", str(tmp_path / "market_data.duckdb"))
@@ -0,0 +1,42 @@
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+
+from risk_engine import api
+from risk_engine.core import data_loader
+
+
+@pytest.fixture
+def client(temp_db):
+    with TestClient(api.app) as test_client:
+        token = test_client.post("/token", data={"username": api.ADMIN_USER, "password": api.ADMIN_PASS}).json()["access_token"]
+        test_client.headers["Authorization"] = f"Bearer {token}"
+        yield test_client
+
+
+def test_data_stays_readable_while_ingest_downloads(client, monkeypatch, prices):
+    data_loader.save_to_duckdb(prices('MSFT', [date(2023, 1, 3)]))
+    reads = []
+
+    def fetch_market_data(tickers, start_date, end_date):
+        # A /data read arriving while the download is in flight
+        reads.append(client.get("/data/MSFT").status_code)
+        return prices('AAPL', [date(2023, 1, 3), date(2023, 1, 4)])
+
+    monkeypatch.setattr(data_loader, "fetch_market_data", fetch_market_data)
+    response = client.post("/ingest", json={"tickers": ["AAPL"], "start_date": "2023-01-01", "end_date": "2023-01-05"})
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "success"
+    assert reads == [200]
+
+
+def test_vol_shock_repeats_with_cached_baseline(client):
+    body = {"ticker": "AAPL", "scenario_type": "vol_shock", "shock_value": 0.5, "initial_price": 100.0}
+    first = client.post("/stress-test", json=body)
+    second = client.post("/stress-test", json=body)
+
+    assert first.status_code == 200
+    assert first.json() == second.json()
+    assert first.json()["new_var_99"] > first.json()["normal_var_99"]
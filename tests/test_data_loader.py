@@ -0,0 +1,149 @@
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import duckdb
+import pandas as pd
+import pytest
+
+from risk_engine.core import data_loader
+
+LISTING = datetime(2017, 8, 17, tzinfo=timezone.utc)
+LAST_CANDLE = datetime(2025, 6, 30, tzinfo=timezone.utc)
+
+
+class StubExchange:
+    """Binance stand-in: daily candles from LISTING to LAST_CANDLE, answering like fetch_ohlcv."""
+    rateLimit = 0
+
+    def parse8601(self, value):
+        return int(datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+    def fetch_ohlcv(self, ticker, timeframe='1d', since=None, limit=1000):
+        first = max(since, int(LISTING.timestamp() * 1000))
+        last = int(LAST_CANDLE.timestamp() * 1000)
+        stamps = range(first, last + 1, data_loader.DAY_MS)[:limit]
+        return [[ts, 1.0, 2.0, 0.5, 1.5, 10.0] for ts in stamps]
+
+
+@pytest.fixture
+def stub_binance(monkeypatch, tmp_path):
+    monkeypatch.setattr(data_loader, "get_binance", lambda: StubExchange())
+    monkeypatch.setattr(data_loader, "CACHE_DIR", str(tmp_path / "cache"))
+
+
+def test_crypto_range_starting_before_listing_keeps_all_data(stub_binance):
+    df = data_loader.fetch_crypto_data('BTC/USDT', '2005-01-01', '2024-12-31')
+
+    dates = list(df['Date'])
+    assert dates[0] == LISTING.date()
+    assert dates[-1] >= date(2024, 12, 30)
+    # One candle per day, no gaps and no overlap between pages
+    assert all(b - a == timedelta(days=1) for a, b in zip(dates, dates[1:]))
+
+
+def test_crypto_empty_range_returns_nothing(stub_binance):
+    df = data_loader.fetch_crypto_data('BTC/USDT', '2024-12-31', '2024-12-01')
+    assert df.empty
+
+
+def test_yahoo_tickers_download_concurrently(monkeypatch, tmp_path):
+    monkeypatch.setattr(data_loader, "CACHE_DIR", str(tmp_path / "cache"))
+    tickers = ['AAPL', 'MSFT', 'SPY']
+    # Every download waits until all of them are in flight, so a serial loop would time out here
+    in_flight = threading.Barrier(len(tickers), timeout=5)
+
+    def download(ticker, start, end, **kwargs):
+        in_flight.wait()
+        index = pd.DatetimeIndex([pd.Timestamp(2023, 1, 3), pd.Timestamp(2023, 1, 4)], name='Date')
+        columns = pd.MultiIndex.from_product([[ticker], ['Open', 'High', 'Low', 'Close', 'Volume']])
+        return pd.DataFrame(1.0, index=index, columns=columns)
+
+    monkeypatch.setattr(data_loader.yf, "download", download)
+    df = data_loader.fetch_market_data(tickers, '2023-01-01', '2023-01-05')
+
+    assert sorted(df['Ticker'].unique()) == tickers
+    assert len(df) == 2 * len(tickers)
+
+
+def test_stored_range_with_gap_is_not_covered(temp_db, prices):
+    days = [date(2023, 1, 3), date(2023, 1, 4), date(2023, 12, 28), date(2023, 12, 29)]
+    data_loader.save_to_duckdb(prices('AAPL', days))
+
+    assert data_loader.get_stored_row_count(['AAPL'], '2023-01-01', '2023-12-31') is None
+
+
+def test_stored_trading_days_cover_range(temp_db, prices):
+    # Weekdays only: weekends leave at most a 3-day step
+    days = [date(2023, 1, 2) + timedelta(days=i) for i in range(364)]
+    days = [d for d in days if d.weekday() < 5]
+    data_loader.save_to_duckdb(prices('AAPL', days))
+
+    assert data_loader.get_stored_row_count(['AAPL'], '2023-01-01', '2023-12-31') == len(days)
+
+
+def test_exchange_closure_does_not_break_coverage(temp_db, prices):
+    # Hurricane Sandy: no trading between Friday 2012-10-26 and Wednesday 2012-10-31
+    days = [date(2012, 10, 1) + timedelta(days=i) for i in range(61)]
+    days = [d for d in days if d.weekday() < 5 and d not in (date(2012, 10, 29), date(2012, 10, 30))]
+    data_loader.save_to_duckdb(prices('SPY', days))
+
+    assert data_loader.get_stored_row_count(['SPY'], '2012-10-01', '2012-11-30') == len(days)
+
+
+def test_coverage_check_coexists_with_readers(temp_db, prices):
+    data_loader.save_to_duckdb(prices('AAPL', [date(2023, 1, 3)]))
+    reader = duckdb.connect(data_loader.DB_PATH, read_only=True)
+    try:
+        assert data_loader.get_stored_row_count(['AAPL'], '2023-01-03', '2023-01-03') == 1
+    finally:
+        reader.close()
+
+
+def test_binance_requests_are_spaced_across_threads():
+    class Paced:
+        rateLimit = 20
+
+    times = []
+
+    def request():
+        data_loader.wait_binance_slot(Paced(), cost=1)
+        times.append(time.monotonic())
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    times.sort()
+    assert all(b - a >= 0.019 for a, b in zip(times, times[1:]))
+
+
+@pytest.mark.parametrize("existing_rows", [False, True])
+def test_repeated_key_in_batch_keeps_last_row(temp_db, existing_rows, prices):
+    if existing_rows:
+        data_loader.save_to_duckdb(prices('AAPL', [date(2023, 1, 3)]))
+    batch = prices('AAPL', [date(2023, 1, 4)] * 3)
+    batch['Close'] = [1.0, 2.0, 3.0]
+    data_loader.save_to_duckdb(batch)
+
+    stored = data_loader.load_data_from_db('AAPL')
+    assert list(stored.loc[stored['Date'] == pd.Timestamp(2023, 1, 4), 'Close']) == [3.0]
+
+
+def test_primary_key_from_older_databases_is_dropped(temp_db):
+    con = duckdb.connect(data_loader.DB_PATH)
+    con.execute("""
+        CREATE TABLE market_prices (
+            Date DATE, Ticker VARCHAR, Open DOUBLE, High DOUBLE, Low DOUBLE, Close DOUBLE, Volume BIGINT,
+            PRIMARY KEY (Date, Ticker)
+        )
+    """)
+    con.execute("INSERT INTO market_prices VALUES ('2023-01-04', 'AAPL', 1, 1, 1, 1, 1), ('2023-01-03', 'AAPL', 1, 1, 1, 1, 1)")
+    con.close()
+
+    with data_loader.get_db_connection() as con:
+        constraints = con.execute("SELECT constraint_type FROM duckdb_constraints() WHERE table_name = 'market_prices'").fetchall()
+    assert ('PRIMARY KEY',) not in constraints
+    assert list(data_loader.load_data_from_db('AAPL')['Date']) == [pd.Timestamp(2023, 1, 3), pd.Timestamp(2023, 1, 4)]
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from risk_engine.core import risk_metrics
+
+
+@pytest.mark.parametrize("confidence_level", [0.95, 0.99])
+def test_var_cvar_agree_across_entry_points(confidence_level):
+    prices = np.random.default_rng(7).normal(100, 10, 10001).astype(np.float32)
+    original = prices.copy()
+
+    var, cvar = risk_metrics.calculate_var_cvar(prices, 100, confidence_level)
+
+    assert risk_metrics.calculate_var(prices, 100, confidence_level) == var
+    assert risk_metrics.calculate_cvar(prices, 100, confidence_level) == cvar
+    assert risk_metrics.var_cvar_from_sorted(np.sort(prices), 100, confidence_level) == (var, cvar)
+    assert cvar >= var > 0
+    # The caller's array is not reordered
+    assert np.array_equal(prices, original)
+
+
+def test_gains_in_the_tail_report_no_loss():
+    assert risk_metrics.calculate_var_cvar(np.array([120.0, 130.0]), 100, 0.95) == (0.0, 0.0)
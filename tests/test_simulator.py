@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from scipy.special import ndtr
+
+from risk_engine.core import simulator
+from risk_engine.core.simulator import MonteCarloSimulator
+
+
+def test_antithetic_draws_come_in_opposite_pairs():
+    z = simulator.draw_normals(np.random.default_rng(0), 1000, "antithetic")
+
+    assert len(z) == 1000
+    np.testing.assert_array_equal(z[:500], -z[500:])
+
+
+def test_sobol_draws_are_balanced():
+    z = simulator.draw_normals(np.random.default_rng(0), 1024, "sobol")
+
+    assert len(z) == 1024
+    assert abs(z.mean()) < 1e-3
+    # One point in every 1/1024 stratum of the uniforms
+    strata = np.floor(ndtr(z.astype(np.float64)) * 1024)
+    np.testing.assert_array_equal(np.sort(strata), np.arange(1024))
+
+
+def test_sobol_rejects_unbalanced_counts():
+    with pytest.raises(ValueError):
+        simulator.draw_normals(np.random.default_rng(0), 1000, "sobol")
+
+
+def test_sobol_chunks_are_powers_of_two():
+    n_paths = 3 * simulator.FINAL_CHUNK_PATHS + 9950
+    sizes = MonteCarloSimulator._sobol_chunk_sizes(n_paths)
+
+    assert sum(sizes) == n_paths
+    assert all(size & (size - 1) == 0 for size in sizes)
+
+
+def test_sobol_final_prices_have_gbm_mean():
+    sim = MonteCarloSimulator(n_paths=99950, sampling="sobol")
+    final_prices = sim.simulate_final(100.0, 0.05, 0.2, seed=7)
+
+    assert len(final_prices) == 99950
+    # E[S_T] = S0 * exp(mu * T)
+    assert final_prices.mean() == pytest.approx(100.0 * np.exp(0.05), rel=1e-3)
+
+
+@pytest.mark.parametrize("sampling", simulator.SAMPLING_METHODS)
+def test_seeded_runs_repeat_exactly(sampling):
+    sim = MonteCarloSimulator(n_paths=5000, time_horizon=21, sampling=sampling)
+
+    first = sim.simulate_summary(100.0, 0.05, 0.2, seed=42)
+    second = sim.simulate_summary(100.0, 0.05, 0.2, seed=42)
+
+    np.testing.assert_array_equal(first[0], second[0])
+    np.testing.assert_array_equal(first[1], second[1])
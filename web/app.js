@@ -319,10 +319,13 @@ async function ingestData() {
             status.style.color = "#48bb78";
 
             // Render Preview
-            if (data.preview && data.preview.length > 0) {
-                renderDataTable(data.preview);
+            if (data.preview_columns && data.preview_columns.length > 0) {
+                renderDataTable(data.preview_columns, data.preview);
                 document.getElementById("ingest-preview-container").classList.remove("hidden");
             }
+        } else if (data.status === "cached") {
+            status.innerText = `Already stored: ${data.rows} rows, download skipped.`;
+            status.style.color = "#48bb78";
         } else {
             status.innerText = data.message;
             status.style.color = "#e53e3e";
@@ -395,7 +398,7 @@ async function runStressTest() {
 }
 
 // --- UI Helpers ---
-function renderDataTable(data) {
+function renderDataTable(headers, columns) {
     const table = document.getElementById("ingest-preview-table");
     const thead = table.querySelector("thead");
     const tbody = table.querySelector("tbody");
@@ -404,10 +407,11 @@ function renderDataTable(data) {
     thead.innerHTML = "";
     tbody.innerHTML = "";
 
-    if (data.length === 0) return;
+    // Data is column-oriented: { column: [values...] }
+    const nRows = columns[headers[0]].length;
+    if (nRows === 0) return;
 
     // Headers
-    const headers = Object.keys(data[0]);
     const trHead = document.createElement("tr");
     headers.forEach(h => {
         const th = document.createElement("th");
@@ -417,15 +421,15 @@ function renderDataTable(data) {
     thead.appendChild(trHead);
 
     // Rows
-    data.forEach(row => {
+    for (let i = 0; i < nRows; i++) {
         const tr = document.createElement("tr");
         headers.forEach(h => {
             const td = document.createElement("td");
-            td.innerText = row[h];
+            td.innerText = columns[h][i];
             tr.appendChild(td);
         });
         tbody.appendChild(tr);
-    });
+    }
 }
 
 // --- Dashboard ---